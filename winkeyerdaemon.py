@@ -13,6 +13,15 @@ See README.md for more information.
 See https://github.com/drewarnett/pywinkeyerdaemon for even more information.
 """
 
+import bisect
+import contextlib
+import errno
+import functools
+import os
+import re
+import socket
+import stat
+import threading
 import string
 import socketserver
 import argparse
@@ -22,9 +31,36 @@ import serial
 
 
 _LOCALHOST_ADDRESS = "127.0.0.1"
+_LOCALHOST_ADDRESSES = frozenset((_LOCALHOST_ADDRESS, "::1"))
+_ALL_ADDRESSES = ""
 _DEFAULT_PORT = 6789
 
-ESC = chr(27)
+# requested socket receive buffer, room for bursts from logging programs
+_RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# most datagrams already waiting to handle before flushing to the keyer
+_MAX_QUEUED_DATAGRAMS = 32
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+ESC = b'\x1b'
+
+# trailing whitespace stripped from messages, except ' '
+_WHITESPACE_TO_STRIP = string.whitespace.replace(' ', '').encode()
+
+_TO_UPPERCASE = bytes.maketrans(
+    string.ascii_lowercase.encode(), string.ascii_uppercase.encode())
+
+# fixed WinKeyer command bytes
+_CMD_HOST_OPEN = b'\x00\x02'
+_CMD_HOST_CLOSE = b'\x00\x03'
+_CMD_ABORT = b'\x0a'
+_CMD_PTT_ON = b'\x18\x01'
+_CMD_PTT_OFF = b'\x18\x00'
+
+# WinKeyer commands for every valid argument, indexed by the argument
+_CMD_SET_SPEED = tuple(bytes((0x02, speed)) for speed in range(100))
+_CMD_TUNE = tuple(bytes((0x19, seconds)) for seconds in range(100))
+_CMD_PTT = (_CMD_PTT_OFF, _CMD_PTT_ON)
 
 WK_SIDETONE_CODES = {
     4000:  0x1,
@@ -40,27 +76,27 @@ WK_SIDETONE_CODES = {
 
 WK_SIDETONE_FREQUENCIES = tuple(sorted(WK_SIDETONE_CODES))
 
+_CMD_SET_SIDETONE = {
+    code: bytes((0x01, code)) for code in WK_SIDETONE_CODES.values()}
+
+
+_SIDETONE_CODES_BY_INDEX = tuple(
+    WK_SIDETONE_CODES[freq] for freq in WK_SIDETONE_FREQUENCIES)
+
 
 def wk_sidetone_code(freq):
 
     assert isinstance(freq, int), (type(freq), freq)
-    chosen_freq = None
-    min_freq = min(WK_SIDETONE_FREQUENCIES)
-    max_freq = max(WK_SIDETONE_FREQUENCIES)
-    if freq <= min_freq:
-        chosen_freq = min_freq
-    elif freq >= max_freq:
-        chosen_freq = max_freq
-    else:
-        for i, current_freq in enumerate(WK_SIDETONE_FREQUENCIES[:-1]):
-            next_freq = WK_SIDETONE_FREQUENCIES[i + 1]
-            if freq < next_freq:
-                if freq - current_freq < next_freq - freq:
-                    chosen_freq = current_freq
-                else:
-                    chosen_freq = next_freq
-                break
-    return WK_SIDETONE_CODES[chosen_freq]
+    if freq <= WK_SIDETONE_FREQUENCIES[0]:
+        return _SIDETONE_CODES_BY_INDEX[0]
+    if freq >= WK_SIDETONE_FREQUENCIES[-1]:
+        return _SIDETONE_CODES_BY_INDEX[-1]
+    i = bisect.bisect_left(WK_SIDETONE_FREQUENCIES, freq)
+    lower_freq = WK_SIDETONE_FREQUENCIES[i - 1]
+    upper_freq = WK_SIDETONE_FREQUENCIES[i]
+    if freq - lower_freq < upper_freq - freq:
+        i -= 1
+    return _SIDETONE_CODES_BY_INDEX[i]
 
 
 WK_ULTIMATIC_PRIORITY_CODES = {
@@ -79,6 +115,15 @@ WK_HANG_TIME_CODES = {
 
 WK_HANG_TIMES = tuple(sorted(WK_HANG_TIME_CODES))
 
+# PTT lead and tail times (ms)
+WK_PTT_TIMES = frozenset(range(0, 250 + 10, 10))
+
+WK_KEYING_MODE_CODES = {
+    'B':  0b00,
+    'A':  0b01,
+    'ultimatic':  0b10,
+    'bug':  0b11}
+
 # K[12]_ENABLE bit field per example WinKyer USB and WK3 documentation  :-)
 WK_PINCONFIG_KEY_BITS = {   # [corrected][key]
     False:  {
@@ -93,10 +138,19 @@ class WinKeyer():
     """singleton handler for a WinKeyer
 
     methods are specific to use as a cwdaemon
+
+    Commands are queued and sent with a single serial write by flush().
     """
 
     SUPPORTED_VERSIONS = (23, 30, 31)
 
+    __slots__ = (
+        '_corrected', '_debug', 'port', '_tx_buf', '_settings',
+        '_batched_settings', 'lock',
+        '_host_is_open', '_sidetone_enable', '_key1_enable', '_key2_enable',
+        '_ptt_enable', '_ultimatic_priority', '_hang_time', '_lead_time',
+        '_tail_time')
+
     def __init__(
             self,
             serial_device=None,
@@ -108,7 +162,24 @@ class WinKeyer():
         self._corrected = corrected
         self._debug = debug
         self.port = serial.Serial(serial_device, 1200)
+        try:
+            # don't let the tty layer hold back small writes.  pyserial
+            # supports this on Linux only.  Other POSIX platforms raise
+            # NotImplementedError, MS-Windows has no such method, and Linux
+            # drivers without it raise ValueError.
+            self.port.set_low_latency_mode(True)
+        except (AttributeError, NotImplementedError, ValueError) as e:
+            self.printdbg("serial low latency mode not set:  " + str(e))
+        self._tx_buf = bytearray()
+        # last command queued per register setting opcode, see _write_setting
+        self._settings = {}
+        # register setting commands held until the end of a batch, or None
+        self._batched_settings = None
+        # held by threads sharing the keyer while queueing and flushing
+        self.lock = threading.Lock()
+        self._host_is_open = False
         self.host_open()
+        atexit.register(self.host_close)
         self._sidetone_enable = True
         self._key1_enable = True
         self._key2_enable = False
@@ -124,29 +195,102 @@ class WinKeyer():
         if self._debug:
             print(s)
 
+    def _write(self, *chunks):
+        """queue commands for the next flush"""
+
+        for chunk in chunks:
+            self._tx_buf += chunk
+
+    def _write_setting(self, command):
+        """queue a register setting command unless it is already in effect
+
+        command:  bytes, opcode first
+        """
+
+        if self._batched_settings is not None:
+            self._batched_settings[command[0]] = command
+        elif self._settings.get(command[0]) != command:
+            self._settings[command[0]] = command
+            self._write(command)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """context manager sending the commands given within in one write
+
+        Only the last setting of each register is sent, after any other
+        commands given within.
+        """
+
+        self._batched_settings = {}
+        try:
+            yield self
+        finally:
+            settings, self._batched_settings = self._batched_settings, None
+            for command in settings.values():
+                self._write_setting(command)
+            self.flush()
+
+    def flush(self):
+        """write all queued commands to the WinKeyer with a single write"""
+
+        if self._tx_buf:
+            self.port.write(self._tx_buf)
+            self._tx_buf.clear()
+
+    def write_immediate(self, data):
+        """write data now, after anything already queued"""
+
+        self._write(data)
+        self.flush()
+
     def host_open(self):
-        self.host_close()
+        """open host mode and check the WinKeyer version
+
+        Does nothing if host mode is already open.
+        """
+
+        if self._host_is_open:
+            return
+        # in case host mode was left open, ex. by an earlier run
+        self.write_immediate(_CMD_HOST_CLOSE)
         self.port.flushInput()
         self.port.timeout = 1
-        self.port.write((chr(0x0) + chr(0x2)).encode())
-        version = ord(self.port.read(1).decode())
+        self.write_immediate(_CMD_HOST_OPEN)
+        response = self.port.read(1)
+        if not response:
+            raise serial.SerialException(
+                "no response from WinKeyer on {}".format(self.port.port))
+        version = response[0]
         self.printdbg("host_open returned:  " + str(version))
         assert version in self.SUPPORTED_VERSIONS, version
         self.port.timeout = 0.1
-        atexit.register(self.host_close)
+        # make no assumptions about register contents after (re)opening
+        self._settings.clear()
+        self._host_is_open = True
 
     def host_close(self):
-        self.port.write((chr(0x0) + chr(0x3)).encode())
+        """close host mode, if open"""
+
+        with self.lock:
+            if self._host_is_open:
+                self.write_immediate(_CMD_HOST_CLOSE)
+                self._host_is_open = False
 
     def set_speed(self, speed):
         assert 0 <= speed <= 99
-        self.port.write((chr(0x2) + chr(speed)).encode())
+        self._write_setting(_CMD_SET_SPEED[speed])
 
     def abort(self):
-        self.port.write(chr(0xa).encode())
+        self.write_immediate(_CMD_ABORT)
 
     def send(self, msg):
-        self.port.write(msg.upper().encode())
+        """send message bytes as given
+
+        Letters should already be uppercase.  Buffered commands, such as
+        speed changes, may be embedded.
+        """
+
+        self._write(msg)
 
     def tune(self, seconds):
         """key down for given seconds
@@ -157,8 +301,7 @@ class WinKeyer():
         assert isinstance(seconds, int), type(seconds)
         assert 0 <= seconds <= 99, seconds
 
-        self.abort()
-        self.port.write((chr(0x19) + chr(seconds)).encode())
+        self._write(_CMD_ABORT, _CMD_TUNE[seconds])
 
     def set_first_extension(self, extension):
         """set extension of first keying element
@@ -171,7 +314,7 @@ class WinKeyer():
         assert isinstance(extension, int), (type(extension), extension)
         assert 0 <= extension <= 250, extension
 
-        self.port.write((chr(0x10) + chr(extension)).encode())
+        self._write_setting(bytes((0x10, extension)))
 
     def set_key_compensation(self, compensation):
         """set key compensation
@@ -185,7 +328,7 @@ class WinKeyer():
             type(compensation), compensation)
         assert 0 <= compensation <= 250, compensation
 
-        self.port.write((chr(0x11) + chr(compensation)).encode())
+        self._write_setting(bytes((0x11, compensation)))
 
     def set_weighting(self, weighting):
         """set weighting for keying
@@ -204,7 +347,7 @@ class WinKeyer():
         if weighting > 90:
             weighting = 90
 
-        self.port.write((chr(0x03) + chr(weighting)).encode())
+        self._write_setting(bytes((0x03, weighting)))
 
     def _set_ptt_lead_tail_time(self, lead_time=None, tail_time=None):
         """set PTT lead and tail times (in milliseconds)
@@ -214,20 +357,17 @@ class WinKeyer():
         tail_time:  key up to PTT release from 0 to 250 in 10 ms steps (int)
         """
 
-        VALID_STEPS = tuple(range(0, 250 + 10, 10))
-
         if lead_time is not None:
             assert isinstance(lead_time, int), (type(lead_time), lead_time)
-            assert lead_time in VALID_STEPS, lead_time
+            assert lead_time in WK_PTT_TIMES, lead_time
             self._lead_time = lead_time
         if tail_time is not None:
             assert isinstance(tail_time, int), (type(tail_time), tail_time)
-            assert tail_time in VALID_STEPS, tail_time
+            assert tail_time in WK_PTT_TIMES, tail_time
             self._tail_time = tail_time
 
-        self.port.write((
-            chr(0x04)
-            + chr(self._lead_time//10) + chr(self._tail_time//10)).encode())
+        self._write_setting(
+            bytes((0x04, self._lead_time//10, self._tail_time//10)))
 
     def set_lead_time(self, lead_time):
         """set lead time
@@ -257,10 +397,7 @@ class WinKeyer():
                automatic PTT is enabled.
         """
 
-        if ptt:
-            self.port.write((chr(0x18) + chr(1)).encode())
-        else:
-            self.port.write((chr(0x18) + chr(0)).encode())
+        self._write(_CMD_PTT[bool(ptt)])
 
     def _set_pinconfig(
             self,
@@ -315,20 +452,24 @@ class WinKeyer():
             assert hang_time in WK_HANG_TIMES, hang_time
             self._hang_time = hang_time
 
+        self._write_setting(self._pinconfig_command())
+
+    def _pinconfig_command(self):
+        """returns set pinconfig command bytes for the current settings"""
+
         upc = WK_ULTIMATIC_PRIORITY_CODES[self._ultimatic_priority]
 
-        key1_enable_bit = WK_PINCONFIG_KEY_BITS[self._corrected][1]
-        key2_enable_bit = WK_PINCONFIG_KEY_BITS[self._corrected][2]
+        key_enable_bits = WK_PINCONFIG_KEY_BITS[self._corrected]
 
         data = (
             ((upc & 0b11) << 6)
             | ((WK_HANG_TIME_CODES[self._hang_time] & 0b11) << 4)
-            | ((int(self._key2_enable) & 0b1) << key2_enable_bit)
-            | ((int(self._key1_enable) & 0b1) << key1_enable_bit)
+            | ((int(self._key2_enable) & 0b1) << key_enable_bits[2])
+            | ((int(self._key1_enable) & 0b1) << key_enable_bits[1])
             | ((int(self._sidetone_enable) & 0b1) << 1)
             | ((int(self._ptt_enable) & 0b1) << 0))
 
-        self.port.write((chr(0x09) + chr(data)).encode())
+        return bytes((0x09, data))
 
     def set_key1_enable(self, enable):
         """set key 1 enable"""
@@ -381,8 +522,7 @@ class WinKeyer():
         frequency:  int (Hz)
         """
 
-        code = wk_sidetone_code(frequency)
-        self.port.write((chr(0x01) + chr(code)).encode())
+        self._write_setting(_CMD_SET_SIDETONE[wk_sidetone_code(frequency)])
 
     def set_winkeyer_mode(
             self,
@@ -401,48 +541,88 @@ class WinKeyer():
         autospace:  autospace feature (bool, default False)
         """
 
-        KEYING_CODES = {
-            'B':  0b00,
-            'A':  0b01,
-            'ultimatic':  0b10,
-            'bug':  0b11}
-
         assert isinstance(swap, bool), (type(swap), swap)
-        assert keying_mode in KEYING_CODES, keying_mode
+        assert keying_mode in WK_KEYING_MODE_CODES, keying_mode
         assert isinstance(contest_spacing, bool), (
             type(contest_spacing), contest_spacing)
         assert isinstance(autospace, bool), (type(autospace), autospace)
 
         data = (
-            ((KEYING_CODES[keying_mode] & 0b11) << 4)
+            ((WK_KEYING_MODE_CODES[keying_mode] & 0b11) << 4)
             | ((int(swap) & 0b1) << 3)
             | ((int(autospace) & 0b1) << 1)
             | ((int(contest_spacing) & 0b1) << 0)
             )
-        self.port.write((chr(0x0E) + chr(data)).encode())
-
-
-def _expand_cwdaemon_prosigns_for_winkeyer(s):
-    """returns string with cwdaemon prosigns expanded for winkeyer"""
-
-    MERGE_LETTERS = "\x1b"
-    TABLE = {
-        '*':  "AR",
-        '=':  "BT",
-        '<':  "SK",
-        '(':  "KN",
-        '!':  "SN",
-        '&':  "AS",
-        '>':  "BK"
-        }
-
-    rval = ""
-    for c in s:
-        if c in TABLE:
-            rval += MERGE_LETTERS + TABLE[c]
+        self._write_setting(bytes((0x0E, data)))
+
+
+_MERGE_LETTERS = b"\x1b"
+
+_PROSIGNS = {
+    b'*':  _MERGE_LETTERS + b"AR",
+    b'=':  _MERGE_LETTERS + b"BT",
+    b'<':  _MERGE_LETTERS + b"SK",
+    b'(':  _MERGE_LETTERS + b"KN",
+    b'!':  _MERGE_LETTERS + b"SN",
+    b'&':  _MERGE_LETTERS + b"AS",
+    b'>':  _MERGE_LETTERS + b"BK"
+    }
+
+_CANCEL_BUFFERED_SPEED_CHANGE = b"\x1e"
+_BUFFERED_SPEED_CHANGE = b"\x1c"
+_MIN_SPEED, _MAX_SPEED = 5, 99
+_BUFFERED_SPEED_CHANGES = tuple(
+    _BUFFERED_SPEED_CHANGE + bytes((speed,))
+    for speed in range(_MAX_SPEED + 1))
+
+# cwdaemon prosigns and +/- speed controls
+_MESSAGE_CONTROL_RE = re.compile(
+    b"[" + re.escape(b"".join(_PROSIGNS) + b"+-") + b"]")
+
+
+def _expand_cwdaemon_message_for_winkeyer(s, speed):
+    """returns cwdaemon message translated to bytes to send to winkeyer
+
+    Letters are uppercased, then one regex pass expands prosigns and +/-
+    speed controls.
+
+    Each prosign becomes the buffered merge letters command (ESC) followed
+    by its two letters.  Each + or - becomes a buffered speed change 2 WPM
+    faster or slower, and the message ends by cancelling the buffered
+    speed change.  If the speed is not set (0), + and - are dropped.
+
+    s:  message (bytes)
+
+    speed:  current speed (int WPM) or 0 if not set
+    """
+
+    speed_changed = False
+
+    def expand_control(match):
+        nonlocal speed, speed_changed
+        control = match.group()
+        if control in _PROSIGNS:
+            return _PROSIGNS[control]
+        if not speed:
+            return b""
+        if control == b'+':
+            if speed > _MAX_SPEED - 2:
+                speed = _MAX_SPEED
+            else:
+                speed += 2
         else:
-            rval += c
-    return rval
+            if speed < _MIN_SPEED + 2:
+                speed = _MIN_SPEED
+            else:
+                speed -= 2
+        speed_changed = True
+        return _BUFFERED_SPEED_CHANGES[speed]
+
+    s = _MESSAGE_CONTROL_RE.sub(expand_control, s.translate(_TO_UPPERCASE))
+    if speed_changed:
+        # messages won't leave speed modified
+        s += _CANCEL_BUFFERED_SPEED_CHANGE
+    return s
 
 
 def winkeyer_weighting(cwdaemon_value):
@@ -464,198 +644,352 @@ def winkeyer_weighting(cwdaemon_value):
     return wk_value
 
 
-class CwdaemonServer(socketserver.BaseRequestHandler):
-    """singleton cwdaemon using a singleton winkeyer"""
+class _State():
+    """cwdaemon state kept between client requests"""
 
-    _debug = False
+    __slots__ = ('delay', 'ptt', 'speed')
 
-    def printdbg(self, s):
+    def __init__(self):
+        self.delay = 0
+        self.ptt = False
+        self.speed = 0
+
+
+_state = _State()
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_int(payload):
+    """returns int value of a cwdaemon command payload (bytes)
+
+    Memoized, since clients repeat the same few speeds, tones and times.
+    """
+
+    return int(payload)
+
+
+def _noop(s):
+    pass
+
+
+class CwdaemonServer():
+    """singleton cwdaemon using a singleton winkeyer
+
+    One instance handles every client datagram.  See CwdaemonUDPServer.
+    """
+
+    __slots__ = (
+        'winkeyer', '_send', '_set_speed', '_abort', '_debug', 'printdbg',
+        '_esc_handlers')
+
+    def __init__(self, winkeyer, debug=False):
+
+        assert isinstance(debug, bool), (type(debug), debug)
+
+        self.winkeyer = winkeyer
+        # the keyer never changes, so bind its per-datagram methods once
+        self._send = winkeyer.send
+        self._set_speed = winkeyer.set_speed
+        self._abort = winkeyer.abort
+        self._debug = debug
+        # no per-call debug flag check
+        self.printdbg = print if debug else _noop
+
+        # ESC command handlers taking the payload, indexed by command byte
+        self._esc_handlers = [
+            functools.partial(self._cmd_unknown, bytes((command,)))
+            for command in range(256)]
+        for command, description in self._ESC_NOT_IMPLEMENTED.items():
+            self._esc_handlers[ord(command)] = functools.partial(
+                self._cmd_not_implemented, description)
+        for command, handler in self._ESC_HANDLERS.items():
+            self._esc_handlers[ord(command)] = functools.partial(
+                handler, self)
+
+    def _cmd_set_speed(self, payload):
+        speed = _parse_int(payload)
         if self._debug:
-            print(s)
+            self.printdbg("set speed:  {}".format(speed))
+        if 0 <= speed <= 99:
+            _state.speed = speed
+            self._set_speed(speed)
+        elif self._debug:
+            self.printdbg(
+                "speed {} out of range 0 to 99 WPM".format(speed))
 
-    def verify_request(self, request, client_address):
-        if accept_remote:
-            return True
-        elif client_address == _LOCALHOST_ADDRESS:
-            return True
+    def _cmd_set_tone(self, payload):
+        tone = _parse_int(payload)
+        if self._debug:
+            self.printdbg("set tone:  {}".format(tone))
+        self.printdbg(payload)
+        if (tone < 300 or tone > 1000):
+            self.printdbg('cwdaemon docs say 300 to 100 Hz')
+            self.printdbg('    but unixcw defines actual range')
+        if tone == 0:
+            self.winkeyer.set_sidetone_enable(False)
         else:
-            return False
-
-    def handle(self):
+            self.winkeyer.set_sidetone_frequency(tone)
+            self.winkeyer.set_sidetone_enable(True)
 
-        WHITESPACE_TO_STRIP = string.whitespace.replace(' ', '')
+    def _cmd_abort(self, payload):
+        self.printdbg("abort message")
+        self._abort()
 
-        data = self.request[0].decode()
+    def _cmd_set_weighting(self, payload):
+        weighting = _parse_int(payload)
+        if self._debug:
+            self.printdbg("cwdaemon weighting:  {}".format(weighting))
+        if -50 <= weighting <= 50:
+            self.winkeyer.set_weighting(winkeyer_weighting(weighting))
+        else:
+            self.printdbg("weighting out of range (-50 to 50)")
 
-        # NOTE:  some clients send more data than required!
+    def _cmd_obsolete(self, payload):
+        self.printdbg("Warning:  obsolete cwdaemon command.")
 
-        if chr(0) in data:
-            self.printdbg("Warning:  chr(0) in client message")
-            data = data[:data.index(chr(0))]
-
-        if data[0] == ESC:
-            if data[1] == '0':
-                self.printdbg("Warning:  'set defaults' not implemented.")
-            elif data[1] == '2':
-                speed = data[2:]
-                self.printdbg("set speed:  {}".format(speed))
-                set_speed(int(speed))
-                winkeyer.set_speed(int(speed))
-            elif data[1] == '3':
-                tone = data[2:]
-                self.printdbg("set tone:  {}".format(tone))
-                self.printdbg(data[2:])
-                tone = int(tone)
-                if (tone < 300 or tone > 1000):
-                    self.printdbg('cwdaemon docs say 300 to 100 Hz')
-                    self.printdbg('    but unixcw defines actual range')
-                if tone == 0:
-                    winkeyer.set_sidetone_enable(False)
-                else:
-                    winkeyer.set_sidetone_frequency(tone)
-                    winkeyer.set_sidetone_enable(True)
-            elif data[1] == '4':
-                self.printdbg("abort message")
-                winkeyer.abort()
-            elif data[1] == '5':
-                self.printdbg("Warning:  'exit daemon' not implemented.")
-            elif data[1] == '6':
-                self.printdbg(
-                    "Warning:  'set uninterruptible word mode'"
-                    " not implemented.")
-            elif data[1] == '7':
-                weighting = data[2:]
-                self.printdbg("cwdaemon weighting:  {}".format(weighting))
-                weighting = int(weighting)
-                if -50 <= weighting <= 50:
-                    winkeyer.set_weighting(winkeyer_weighting(weighting))
-                else:
-                    self.printdbg("weighting out of range (-50 to 50)")
-            elif data[1] == '8':
-                self.printdbg(
-                    "Warning:  'set device for keying' not implemented.")
-            elif data[1] == '9':
-                self.printdbg("Warning:  obsolete cwdaemon command.")
-            elif data[1] == 'a':
-                ptt = data[2:]
-                if ptt not in ("0", "1"):
-                    self.printdbg(
-                        "Warning:  "
-                        "unsupported value for 'ptt keying off or on'")
-                else:
-                    if get_delay() > 0:
-                        self.printdbg(
-                            "Cannot set PTT.  ptt keying disabled by delay"
-                            " != 0.")
-                    else:
-                        if ptt == "0":
-                            if get_ptt():
-                                winkeyer.assert_ptt(False)
-                                set_ptt(False)
-                        else:
-                            if not get_ptt():
-                                winkeyer.assert_ptt(True)
-                                set_ptt(True)
-            elif data[1] == 'b':
+    def _cmd_ptt(self, payload):
+        ptt = payload
+        if ptt not in (b"0", b"1"):
+            self.printdbg(
+                "Warning:  "
+                "unsupported value for 'ptt keying off or on'")
+        else:
+            if _state.delay > 0:
                 self.printdbg(
-                    "Warning:  'ssb signal from microphone or soundcard'"
-                    " not implemented.")
-            elif data[1] == 'c':
-                seconds = int(data[2:])
-                if 0 <= seconds <= 99:
-                    if seconds:
-                        self.printdbg("tune for {} seconds".format(seconds))
-                        if seconds > 10:
-                            self.printdbg(
-                                "allowing longer tune than cwdaemon's"
-                                " 10 second max")
-                        winkeyer.tune(seconds)
-                    else:
-                        self.printdbg("tune for 0 seconds ignored")
+                    "Cannot set PTT.  ptt keying disabled by delay"
+                    " != 0.")
+            else:
+                if ptt == b"0":
+                    if _state.ptt:
+                        self.winkeyer.assert_ptt(False)
+                        _state.ptt = False
                 else:
+                    if not _state.ptt:
+                        self.winkeyer.assert_ptt(True)
+                        _state.ptt = True
+
+    def _cmd_tune(self, payload):
+        seconds = _parse_int(payload)
+        if 0 <= seconds <= 99:
+            if seconds:
+                if self._debug:
+                    self.printdbg("tune for {} seconds".format(seconds))
+                if seconds > 10:
                     self.printdbg(
-                        "tune for {} seconds out of range"
-                        " 0 to 99 seconds".format(seconds))
-            elif data[1] == 'd':
-                # TODO:  implement range check.  CW daemon uses 0 to 50 and
-                #        truncates into range.
-                # Note:  use 0/nonzero to enable/disable manual PTT
-                # Note:  use 0/nonzero to disable/enable auto PTT?
-                # Note:  Do not want to use to adjust PTT lead time.
-                delay = data[2:]
-                self.printdbg("set delay:  {}".format(delay))
-                set_delay(int(delay))
-                self.printdbg("delay set to:  {:d}".format(get_delay()))
-                self.printdbg(
-                    "have not implemented cwdaemon delay functionality")
-            elif data[1] == 'e':
-                self.printdbg("Warning:  'bandindex' not implemented.")
-            elif data[1] == 'f':
-                self.printdbg("Warning:  'set sound device' not implemented.")
-            elif data[1] == 'g':
-                self.printdbg(
-                    "Warning:  'set soundcard volume' not implemented.")
-            elif data[1] == 'h':
-                self.printdbg("Warning:  'echo when done' not implemented.")
+                        "allowing longer tune than cwdaemon's"
+                        " 10 second max")
+                self.winkeyer.tune(seconds)
+            else:
+                self.printdbg("tune for 0 seconds ignored")
+        elif self._debug:
+            self.printdbg(
+                "tune for {} seconds out of range"
+                " 0 to 99 seconds".format(seconds))
+
+    def _cmd_set_delay(self, payload):
+        # TODO:  implement range check.  CW daemon uses 0 to 50 and
+        #        truncates into range.
+        # Note:  use 0/nonzero to enable/disable manual PTT
+        # Note:  use 0/nonzero to disable/enable auto PTT?
+        # Note:  Do not want to use to adjust PTT lead time.
+        delay = _parse_int(payload)
+        if self._debug:
+            self.printdbg("set delay:  {}".format(delay))
+        _state.delay = delay
+        if self._debug:
+            self.printdbg("delay set to:  {:d}".format(_state.delay))
+        self.printdbg(
+            "have not implemented cwdaemon delay functionality")
+
+    def _cmd_not_implemented(self, description, payload):
+        if self._debug:
+            self.printdbg(
+                "Warning:  '{}' not implemented.".format(description))
+
+    def _cmd_unknown(self, command, payload):
+        if self._debug:
+            self.printdbg(
+                "Warning:  unknown cwdaemon command {}".format(
+                    repr(ESC + command)))
+
+    # cwdaemon ESC command character to handler taking the command payload
+    _ESC_HANDLERS = {
+        b'2':  _cmd_set_speed,
+        b'3':  _cmd_set_tone,
+        b'4':  _cmd_abort,
+        b'7':  _cmd_set_weighting,
+        b'9':  _cmd_obsolete,
+        b'a':  _cmd_ptt,
+        b'c':  _cmd_tune,
+        b'd':  _cmd_set_delay}
+
+    _ESC_NOT_IMPLEMENTED = {
+        b'0':  "set defaults",
+        b'5':  "exit daemon",
+        b'6':  "set uninterruptible word mode",
+        b'8':  "set device for keying",
+        b'b':  "ssb signal from microphone or soundcard",
+        b'e':  "bandindex",
+        b'f':  "set sound device",
+        b'g':  "set soundcard volume",
+        b'h':  "echo when done"}
+
+    def handle(self, data):
+        """handle one client datagram (bytes)"""
+
+        # NOTE:  some clients send more data than required!
+
+        data, nul, _ = data.partition(b'\x00')
+        if nul:
+            self.printdbg("Warning:  chr(0) in client message")
+
+        if data[:1] != ESC:
+            self._handle_message(data)
+        elif len(data) > 1:
+            self._esc_handlers[data[1]](data[2:])
         else:
+            self.printdbg("Warning:  ESC without cwdaemon command")
+
+    def _handle_message(self, data):
+
+        # Debug output is guarded so its formatting is skipped otherwise.
+
+        if self._debug:
             self.printdbg("message:  {}".format(repr(data)))
-            if data.rstrip(WHITESPACE_TO_STRIP) != data:
-                self.printdbg(
-                    "message trailing whitespace (not including ' ') removed")
-                data = data.rstrip(WHITESPACE_TO_STRIP)
+        stripped_data = data.rstrip(_WHITESPACE_TO_STRIP)
+        # rstrip returns the same object when there is nothing to strip
+        if stripped_data is not data:
+            self.printdbg(
+                "message trailing whitespace (not including ' ') removed")
+            data = stripped_data
+        if self._debug:
             self.printdbg("message:  {}".format(repr(data)))
-
-            winkeyer_data = _expand_cwdaemon_prosigns_for_winkeyer(data)
-            if winkeyer_data != data:
-                data = winkeyer_data
+        message = data
+        data = _expand_cwdaemon_message_for_winkeyer(data, _state.speed)
+        if self._debug:
+            if any(prosign in message for prosign in _PROSIGNS):
                 self.printdbg("prosigns expanded")
-                self.printdbg("message:  {}".format(repr(data)))
-
-            CANCEL_BUFFERED_SPEED_CHANGE = "\x1e"
-            BUFFERED_SPEED_CHANGE = "\x1c"
-            MIN_SPEED, MAX_SPEED = 5, 99
-            speed_message_data = ""
-            speed = orig_speed = get_speed()
-            if '+' in data or '-' in data:
-                for nextchar in data:
-                    if nextchar == '+':
-                        if speed:
-                            if speed > MAX_SPEED - 2:
-                                speed = MAX_SPEED
-                            else:
-                                speed += 2
-                            speed_message_data += (
-                                BUFFERED_SPEED_CHANGE + chr(speed))
-                    elif nextchar == '-':
-                        if speed:
-                            if speed < MIN_SPEED + 2:
-                                speed = MIN_SPEED
-                            else:
-                                speed -= 2
-                            speed_message_data += (
-                                BUFFERED_SPEED_CHANGE + chr(speed))
-                    else:
-                        speed_message_data += nextchar
-                if speed:
-                    # messages won't leave speed modified
-                    speed = orig_speed
-                    speed_message_data += CANCEL_BUFFERED_SPEED_CHANGE
+            if b'+' in message or b'-' in message:
+                if _state.speed:
                     self.printdbg(
                         "cwdaemon +/- speed controls expanded/translated")
                 else:
                     self.printdbg(
                         "speed not set, yet,"
                         " so cwdaemon +/- speed controls ignored")
-                data = speed_message_data
-                self.printdbg("message:  {}".format(repr(data)))
+            self.printdbg("message:  {}".format(repr(data)))
+
+        self._send(data)
+
+
+class _CwdaemonDatagramServerMixIn():
+    """passes every datagram to one long-lived CwdaemonServer
+
+    socketserver would otherwise construct a request handler per datagram.
 
-            winkeyer.send(data)
+    Datagrams already waiting behind the one received are handled too
+    before the WinKeyer is flushed, so a burst of client requests becomes
+    a single serial write.
 
+    Servers sharing the CwdaemonServer may run in separate threads.  Each
+    holds the WinKeyer lock from handling a datagram until the flush.
+    """
+
+    def server_bind(self):
+        # The OS may grant less, for example Linux caps at rmem_max.
+        self.socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, _RECEIVE_BUFFER_SIZE)
+        super().server_bind()
+
+    def finish_request(self, request, client_address):
+        self.cwdaemon.handle(request[0])
+
+    def _get_queued_request(self):
+        """returns (request, client_address) already received or None"""
+
+        try:
+            data, client_address = self.socket.recvfrom(
+                self.max_packet_size, _MSG_DONTWAIT)
+        except BlockingIOError:
+            return None
+        return (data, self.socket), client_address
+
+    def process_request(self, request, client_address):
+        with self.cwdaemon.winkeyer.lock:
+            try:
+                super().process_request(request, client_address)
+                # Python has no recvmmsg(), so drain with nonblocking reads
+                for _ in range(
+                        _MAX_QUEUED_DATAGRAMS if _MSG_DONTWAIT else 0):
+                    queued = self._get_queued_request()
+                    if queued is None:
+                        break
+                    request, client_address = queued
+                    if self.verify_request(request, client_address):
+                        try:
+                            super().process_request(
+                                request, client_address)
+                        except Exception:
+                            self.handle_error(request, client_address)
+            finally:
+                self.cwdaemon.winkeyer.flush()
+
+
+class CwdaemonUDPServer(_CwdaemonDatagramServerMixIn, socketserver.UDPServer):
+    """cwdaemon UDP server, see _CwdaemonDatagramServerMixIn"""
+
+    def __init__(self, server_address, cwdaemon, accept_remote=False):
+        self.cwdaemon = cwdaemon
+        self.accept_remote = accept_remote
+        super().__init__(server_address, None)
+
+    def verify_request(self, request, client_address):
+        return self.accept_remote or client_address[0] in _LOCALHOST_ADDRESSES
+
+
+if hasattr(socketserver, "UnixDatagramServer"):
+    class CwdaemonUnixServer(
+            _CwdaemonDatagramServerMixIn, socketserver.UnixDatagramServer):
+        """cwdaemon unix domain datagram server for local clients
+
+        Skips the loopback IP stack.  File permissions on the socket control
+        access.  See _CwdaemonDatagramServerMixIn.
+        """
+
+        def __init__(self, path, cwdaemon):
+            self.cwdaemon = cwdaemon
+            super().__init__(path, None)
+
+        def server_bind(self):
+            # remove a socket left behind by a daemon that was killed
+            try:
+                mode = os.lstat(self.server_address).st_mode
+            except FileNotFoundError:
+                pass
+            else:
+                if not stat.S_ISSOCK(mode):
+                    raise FileExistsError(
+                        "{} exists and is not a socket".format(
+                            self.server_address))
+                # replace it only if no other daemon is still listening
+                with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as probe:
+                    try:
+                        probe.connect(self.server_address)
+                    except ConnectionRefusedError:
+                        os.unlink(self.server_address)
+                    else:
+                        raise OSError(
+                            errno.EADDRINUSE, "address in use",
+                            self.server_address)
+            super().server_bind()
 
-class CwdaemonServerDebug(CwdaemonServer):
-    """CwdameonServer with debugging enabled"""
+        def remove_socket(self):
+            """remove the socket file, if still there"""
 
-    _debug = True
+            try:
+                os.unlink(self.server_address)
+            except FileNotFoundError:
+                pass
 
 
 if __name__ == "__main__":
@@ -674,6 +1008,12 @@ if __name__ == "__main__":
         help="respond to requests from hosts other than localhost (default"
              " localhost only)",
         action="store_true")
+    if hasattr(socketserver, "UnixDatagramServer"):
+        parser.add_argument(
+            "--unix-socket", metavar="PATH",
+            help="also listen on a unix domain datagram socket created at"
+                 " PATH, for local clients",
+            type=str)
     sidetone_group = parser.add_mutually_exclusive_group()
     sidetone_group.add_argument(
         "--sidetone-on",
@@ -738,67 +1078,53 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    state_delay = 0
-    state_ptt = False
-    state_speed = 0
-
-    def set_delay(delay):
-        global state_delay
-        state_delay = delay
-
-    def get_delay():
-        global state_delay
-        return state_delay
-
-    def set_ptt(ptt):
-        global state_ptt
-        state_ptt = ptt
-
-    def get_ptt():
-        global state_ptt
-        return state_ptt
-
-    def set_speed(speed):
-        global state_speed
-        state_speed = speed
-
-    def get_speed():
-        global state_speed
-        return state_speed
-
     accept_remote = args.accept_remote_hosts
     if accept_remote:
         print("Warning:  listening to nonlocal hosts as well as localhost.")
-    winkeyer = WinKeyer(args.device, debug=args.debug)
-
-    assert not hasattr(args, 'key1') and hasattr(args, 'key12')
-    if args.key2:
-        winkeyer.set_key1_enable(False)
-        winkeyer.set_key2_enable(True)
-    if args.key12:
-        winkeyer.set_key1_enable(True)
-        winkeyer.set_key2_enable(True)
-
-    if args.sidetone is not None:
-        winkeyer.set_sidetone_frequency(args.sidetone)
-        winkeyer.set_sidetone_enable(True)
-    else:
-        winkeyer.set_sidetone_enable(args.sidetone_on)
-    winkeyer.set_winkeyer_mode(
-        swap=args.swap,
-        contest_spacing=args.contest_spacing,
-        autospace=args.autospace)
-    if args.key_compensation is not None:
-        winkeyer.set_first_extension(args.key_compensation)
-    if args.first_extension is not None:
-        winkeyer.set_first_extension(args.first_extension)
-    if args.ptt_lead:
-        winkeyer.set_lead_time(args.ptt_lead)
-    if args.ptt_tail:
-        winkeyer.set_tail_time(args.ptt_tail)
-    if args.ptt_enable:
-        winkeyer.set_ptt_enable(True)
-    server_type = CwdaemonServerDebug if args.debug else CwdaemonServer
-    server = socketserver.UDPServer(
-        (_LOCALHOST_ADDRESS, args.port), server_type)
-    server.serve_forever()
+    winkeyer = WinKeyer(args.device, debug=args.debug, set_pinconfig=False)
+
+    # Startup settings go out together in one write.  The sidetone enable
+    # below always sets pinconfig, so its final value is sent once.
+    with winkeyer.batch():
+        assert not hasattr(args, 'key1') and hasattr(args, 'key12')
+        if args.key2:
+            winkeyer.set_key1_enable(False)
+            winkeyer.set_key2_enable(True)
+        if args.key12:
+            winkeyer.set_key1_enable(True)
+            winkeyer.set_key2_enable(True)
+
+        if args.sidetone is not None:
+            winkeyer.set_sidetone_frequency(args.sidetone)
+            winkeyer.set_sidetone_enable(True)
+        else:
+            winkeyer.set_sidetone_enable(args.sidetone_on)
+        winkeyer.set_winkeyer_mode(
+            swap=args.swap,
+            contest_spacing=args.contest_spacing,
+            autospace=args.autospace)
+        if args.key_compensation is not None:
+            winkeyer.set_key_compensation(args.key_compensation)
+        if args.first_extension is not None:
+            winkeyer.set_first_extension(args.first_extension)
+        if args.ptt_lead:
+            winkeyer.set_lead_time(args.ptt_lead)
+        if args.ptt_tail:
+            winkeyer.set_tail_time(args.ptt_tail)
+        if args.ptt_enable:
+            winkeyer.set_ptt_enable(True)
+    cwdaemon = CwdaemonServer(winkeyer, debug=args.debug)
+    server = CwdaemonUDPServer(
+        (_ALL_ADDRESSES if accept_remote else _LOCALHOST_ADDRESS, args.port),
+        cwdaemon,
+        accept_remote=accept_remote)
+    unix_socket = getattr(args, "unix_socket", None)
+    if unix_socket is not None:
+        unix_server = CwdaemonUnixServer(unix_socket, cwdaemon)
+        atexit.register(unix_server.remove_socket)
+        threading.Thread(
+            target=unix_server.serve_forever, kwargs={"poll_interval": None},
+            daemon=True).start()
+    # Nothing calls server.shutdown(), so the periodic wakeup to check for
+    # it is only needed where a blocking select() would not see Ctrl-C.
+    server.serve_forever(poll_interval=None if os.name == "posix" else 0.5)